@@ -1,15 +1,32 @@
 # main_app.py
 
 # Import necessary libraries from Flask and other packages
+import atexit
+import io
 import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import DataError, IntegrityError
 from datetime import datetime
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from PIL import Image
+from blake3 import blake3
+import numpy as np
 import torch
 from transformers import DetrImageProcessor, DetrForObjectDetection
+from transformers.models.detr.modeling_detr import DetrObjectDetectionOutput
 import requests # Used to fetch image from URL if needed, good for testing
+# pyvips (libvips) decodes and shrinks images several times faster than Pillow.
+# It is optional: without it (or without the libvips system library) we fall back to Pillow.
+try:
+    import pyvips
+except (ImportError, OSError):
+    pyvips = None
 
 
 
@@ -25,6 +42,14 @@ CORS(app)
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///local.db')
 # Disable a feature of SQLAlchemy that we don't need and which adds overhead
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Keep a pool of open connections ready instead of opening one per request, and check that a
+# pooled connection is still alive before using it. SQLite doesn't use a connection pool.
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': 20,
+        'max_overflow': 40,
+        'pool_pre_ping': True,
+    }
 # Initialize the SQLAlchemy object with our Flask app
 db = SQLAlchemy(app)
 
@@ -41,17 +66,408 @@ class AnalysisResult(db.Model):
         return f'<AnalysisResult {self.id}>'
 
 
+def collect_batch(pending, max_batch_size, wait_timeout_s):
+    """
+    Blocks until at least one item is in the queue, then keeps taking items until the batch
+    is full or wait_timeout_s has passed. Used by the background workers below.
+    """
+    batch = [pending.get()]
+    deadline = time.monotonic() + wait_timeout_s
+    while len(batch) < max_batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(pending.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+
+# --- Background Database Writer ---
+# Saving a result used to cost a full database round trip inside every request. Instead,
+# requests put their result in a queue and return straight away, and a background thread
+# saves the queued results in batches: up to DB_WRITE_BATCH_SIZE rows per commit, flushed
+# at least every DB_FLUSH_INTERVAL_S seconds.
+# On a normal shutdown (including Ctrl+C) the queue is flushed before the process exits, for at
+# most DB_SHUTDOWN_TIMEOUT_S seconds so a slow or unreachable database can't hang the shutdown.
+# Results not saved by then, or if the process is killed outright, are lost.
+DB_WRITE_BATCH_SIZE = 64
+DB_FLUSH_INTERVAL_S = 0.1
+# Caps how many results can wait in memory. If the database is down, new results are dropped
+# (and logged) once the queue is full, instead of piling up for as long as the outage lasts.
+DB_MAX_PENDING_RESULTS = 1000
+DB_SHUTDOWN_TIMEOUT_S = 5
+pending_results = queue.Queue(maxsize=DB_MAX_PENDING_RESULTS)
+
+
+def save_results(batch, retry_rows=True):
+    """
+    Saves a batch of queued results in one commit. If the batch fails because of bad data
+    (e.g. a filename that is too long), the rows are retried one at a time so the one bad row
+    doesn't lose the others (unless retry_rows is False). Any other error, such as the database
+    being unreachable, drops the batch without retrying, since every row would fail the same way.
+    """
+    # The writer runs outside of any request, so it needs its own app context
+    with app.app_context():
+        try:
+            db.session.bulk_insert_mappings(AnalysisResult, batch)
+            db.session.commit()
+            return
+        except (DataError, IntegrityError) as e:
+            db.session.rollback()
+            if len(batch) == 1 or not retry_rows:
+                # If there's an error with the database, log it to the server console.
+                # In a real production app, you'd have more robust error logging.
+                print(f"Error saving to database: {e}")
+                return
+            print(f"Error saving {len(batch)} results to database, retrying one at a time: {e}")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error saving to database, dropping {len(batch)} results: {e}")
+            return
+        for i, row in enumerate(batch):
+            try:
+                db.session.bulk_insert_mappings(AnalysisResult, [row])
+                db.session.commit()
+            except (DataError, IntegrityError) as e:
+                db.session.rollback()
+                print(f"Error saving to database: {e}")
+            except Exception as e:
+                # The database itself has failed, so the remaining rows would fail too
+                db.session.rollback()
+                print(f"Error saving to database, dropping {len(batch) - i} results: {e}")
+                return
+
+
+def database_writer():
+    while True:
+        batch = collect_batch(pending_results, DB_WRITE_BATCH_SIZE, DB_FLUSH_INTERVAL_S)
+        save_results(batch)
+        # Lets flush_pending_results() know when the batch in progress has been saved
+        for _ in batch:
+            pending_results.task_done()
+
+
+def save_remaining_results():
+    batch = []
+    while True:
+        try:
+            batch.append(pending_results.get_nowait())
+        except queue.Empty:
+            break
+    if batch:
+        # Skip the row-by-row retry so the shutdown stays quick
+        save_results(batch, retry_rows=False)
+        for _ in batch:
+            pending_results.task_done()
+
+
+@atexit.register
+def flush_pending_results():
+    """
+    Saves whatever is still queued when the server shuts down, and waits for the writer thread
+    to finish the batch it is working on. Without this, the daemon thread would be stopped
+    with results still in the queue. Gives up after DB_SHUTDOWN_TIMEOUT_S seconds.
+    """
+    # The save runs on a daemon thread, so a database call that never returns can't block exit
+    threading.Thread(target=save_remaining_results, daemon=True).start()
+    deadline = time.monotonic() + DB_SHUTDOWN_TIMEOUT_S
+    while pending_results.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.05)
+    if pending_results.unfinished_tasks:
+        print(f"Timed out saving to database on shutdown, {pending_results.unfinished_tasks} results not saved")
+
+
+threading.Thread(target=database_writer, daemon=True).start()
+
+
 # ----------------- AI MODEL LOADING -----------------
 # This part is crucial and can be slow, so it's done once when the server starts.
 
+# We only ever run the model for inference, so never record gradients.
+torch.set_grad_enabled(False)
+# Leave half of the CPU cores for the web server threads and image preprocessing
+# (os.cpu_count() can return None when the count can't be determined)
+torch.set_num_threads(max(1, (os.cpu_count() or 2) // 2))
+
 # Load the pre-trained object detection model and its processor from Hugging Face
 # DETR (DEtection TRansformer) is a powerful model for object detection.
 # We are using the 'facebook/detr-resnet-50' version.
 print("Loading model...") # Log message to know when model loading starts
 processor = DetrImageProcessor.from_pretrained('facebook/detr-resnet-50')
 model = DetrForObjectDetection.from_pretrained('facebook/detr-resnet-50')
+# Switch off training-only behaviour such as dropout
+model.eval()
+# A plain list of label names indexed by class id, so looking up a label is a simple list index.
+# The model's id2label has gaps in its ids, so missing ids map to 'N/A'.
+ID2LABEL = [model.config.id2label.get(i, 'N/A') for i in range(max(model.config.id2label) + 1)]
 print("Model loaded successfully!") # Log message to confirm model is ready
 
+# --- Model Runtime ---
+# DETR_RUNTIME picks how the forward pass is executed:
+#   'torchscript' (default) - the model is traced once at startup into a TorchScript graph and
+#                             optimized for inference, which removes the per-op Python overhead.
+#   'openvino'              - an INT8-quantized OpenVINO model produced by quantize_detr.py,
+#                             much faster on CPUs with VNNI instructions.
+#   'onnx'                  - an ONNX export produced by export_detr_onnx.py, run by ONNX Runtime
+#                             with all graph optimizations (op fusion etc.) switched on.
+#   'eager'                 - the plain Hugging Face model, useful for debugging.
+DETR_RUNTIMES = ('torchscript', 'openvino', 'onnx', 'eager')
+DETR_RUNTIME = os.environ.get('DETR_RUNTIME', 'torchscript')
+# Fail at startup on a typo rather than silently running a different runtime
+if DETR_RUNTIME not in DETR_RUNTIMES:
+    raise ValueError(f"Unknown DETR_RUNTIME '{DETR_RUNTIME}', expected one of: {', '.join(DETR_RUNTIMES)}")
+
+# --- Reloader Parent Process ---
+# With debug=True, Werkzeug's reloader runs this file in two processes: a parent that only
+# watches for code changes and restarts the server, and a child (with WERKZEUG_RUN_MAIN set)
+# that actually serves requests. The parent never runs the model, so it skips the GPU,
+# compilation and warm-up work below instead of holding a second copy of the model on the GPU.
+IS_RELOADER_PARENT = __name__ == '__main__' and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+
+# --- Device and Precision ---
+# When the PyTorch model does the inference ('torchscript' or 'eager'), use the GPU if there is
+# one. On a GPU the model also runs in half precision (FP16), which halves memory traffic and
+# uses the tensor cores. Set DETR_FP16=0 to keep full precision.
+# The OpenVINO and ONNX runtimes only need the PyTorch model for its config, so it stays on the
+# CPU and doesn't take up GPU memory.
+USES_TORCH_MODEL = DETR_RUNTIME in ('torchscript', 'eager')
+DEVICE = 'cuda' if USES_TORCH_MODEL and not IS_RELOADER_PARENT and torch.cuda.is_available() else 'cpu'
+USE_FP16 = DEVICE == 'cuda' and os.environ.get('DETR_FP16', '1') != '0'
+MODEL_DTYPE = torch.float16 if USE_FP16 else torch.float32
+model.to(DEVICE, dtype=MODEL_DTYPE)
+
+# Where quantize_detr.py saved the INT8 model (only used when DETR_RUNTIME is 'openvino')
+OPENVINO_MODEL_PATH = os.environ.get('OPENVINO_MODEL_PATH', 'detr_int8.xml')
+# Where export_detr_onnx.py saved the ONNX model (only used when DETR_RUNTIME is 'onnx')
+ONNX_MODEL_PATH = os.environ.get('ONNX_MODEL_PATH', 'detr.onnx')
+
+
+class DetrTraceWrapper(torch.nn.Module):
+    """
+    Exposes DETR with plain tensor inputs and outputs so it can be traced by TorchScript.
+    """
+
+    def __init__(self, detr):
+        super().__init__()
+        self.detr = detr
+
+    def forward(self, pixel_values, pixel_mask):
+        # With return_dict=False the model returns a tuple that starts with (logits, pred_boxes)
+        outputs = self.detr(pixel_values=pixel_values, pixel_mask=pixel_mask, return_dict=False)
+        return outputs[0], outputs[1]
+
+
+def build_torchscript_model(detr):
+    """
+    Traces DETR with a dummy 800x800 image and optimizes the resulting graph for inference.
+    """
+    example_pixel_values = torch.zeros(1, 3, 800, 800, device=DEVICE, dtype=MODEL_DTYPE)
+    example_pixel_mask = torch.ones(1, 800, 800, dtype=torch.long, device=DEVICE)
+    with torch.no_grad():
+        traced = torch.jit.trace(
+            DetrTraceWrapper(detr), (example_pixel_values, example_pixel_mask), check_trace=False
+        )
+    # Freezes the weights into the graph and fuses ops such as conv + batch norm
+    return torch.jit.optimize_for_inference(traced)
+
+
+def make_example_batch():
+    """
+    Builds a dummy batch shaped like a real one: two images of different sizes (800x1066 and
+    800x600), padded to a common size with a pixel mask. Used to check and warm up the model.
+    """
+    pixel_values = torch.rand(2, 3, 800, 1066)
+    pixel_mask = torch.ones(2, 800, 1066, dtype=torch.long)
+    pixel_values[1, :, :, 600:] = 0
+    pixel_mask[1, :, 600:] = 0
+    return pixel_values, pixel_mask
+
+
+def scripted_matches_eager(scripted, detr):
+    """
+    The trace is recorded with a single 800x800 image. Checks that the traced graph gives the
+    same outputs as the eager model for a batch with a different size and padding.
+    """
+    pixel_values, pixel_mask = make_example_batch()
+    pixel_values = pixel_values.to(DEVICE, dtype=MODEL_DTYPE)
+    pixel_mask = pixel_mask.to(DEVICE)
+    with torch.no_grad():
+        expected = detr(pixel_values=pixel_values, pixel_mask=pixel_mask)
+        # TorchScript only specializes the graph after the first run, so compare a later run
+        for _ in range(2):
+            logits, pred_boxes = scripted(pixel_values, pixel_mask)
+    tolerance = 1e-2 if USE_FP16 else 1e-3
+    return (
+        torch.allclose(logits.float(), expected.logits.float(), rtol=tolerance, atol=tolerance)
+        and torch.allclose(pred_boxes.float(), expected.pred_boxes.float(), rtol=tolerance, atol=tolerance)
+    )
+
+
+scripted_model = None
+if DETR_RUNTIME == 'torchscript' and not IS_RELOADER_PARENT:
+    try:
+        print("Compiling model to TorchScript...")
+        scripted_model = build_torchscript_model(model)
+        if not scripted_matches_eager(scripted_model, model):
+            raise RuntimeError("TorchScript outputs differ from the eager model on a batch of mixed-size images")
+        print("Model compiled successfully!")
+    except Exception as e:
+        # Tracing can fail, or give wrong results, on unusual torch/transformers versions;
+        # the eager model still works.
+        scripted_model = None
+        print(f"Could not compile model, falling back to eager mode: {e}")
+
+openvino_model = None
+if DETR_RUNTIME == 'openvino' and not IS_RELOADER_PARENT:
+    # Imported here because OpenVINO is only needed for this runtime
+    import openvino
+    print(f"Loading INT8 OpenVINO model from {OPENVINO_MODEL_PATH}...")
+    openvino_model = openvino.Core().compile_model(OPENVINO_MODEL_PATH, 'CPU')
+    print("OpenVINO model loaded successfully!")
+
+onnx_session = None
+if DETR_RUNTIME == 'onnx' and not IS_RELOADER_PARENT:
+    # Imported here because ONNX Runtime is only needed for this runtime
+    import onnxruntime
+    print(f"Loading ONNX model from {ONNX_MODEL_PATH}...")
+    session_options = onnxruntime.SessionOptions()
+    session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    # Use the GPU if this ONNX Runtime build supports it, otherwise the CPU
+    onnx_session = onnxruntime.InferenceSession(
+        ONNX_MODEL_PATH,
+        sess_options=session_options,
+        providers=['CUDAExecutionProvider', 'CPUExecutionProvider'],
+    )
+    print("ONNX model loaded successfully!")
+
+
+def run_detector(pixel_values, pixel_mask):
+    """
+    Runs one forward pass and returns the raw outputs in the format expected by
+    processor.post_process_object_detection().
+    """
+    if openvino_model is not None:
+        outputs = openvino_model([pixel_values.numpy(), pixel_mask.numpy()])
+        return DetrObjectDetectionOutput(
+            logits=torch.from_numpy(outputs[0]), pred_boxes=torch.from_numpy(outputs[1])
+        )
+    if onnx_session is not None:
+        logits, pred_boxes = onnx_session.run(
+            ['logits', 'pred_boxes'],
+            {'pixel_values': pixel_values.numpy(), 'pixel_mask': pixel_mask.numpy()},
+        )
+        return DetrObjectDetectionOutput(logits=torch.from_numpy(logits), pred_boxes=torch.from_numpy(pred_boxes))
+    # The batch is built in pinned memory (see pad_and_stack), so copying it to the GPU
+    # can happen asynchronously
+    pixel_values = pixel_values.to(DEVICE, dtype=MODEL_DTYPE, non_blocking=True)
+    pixel_mask = pixel_mask.to(DEVICE, non_blocking=True)
+    if scripted_model is not None:
+        logits, pred_boxes = scripted_model(pixel_values, pixel_mask)
+    else:
+        with torch.autocast(device_type='cuda', dtype=torch.float16, enabled=USE_FP16):
+            outputs = model(pixel_values=pixel_values, pixel_mask=pixel_mask)
+        logits, pred_boxes = outputs.logits, outputs.pred_boxes
+    # Post-processing always runs in full precision on the CPU. Detaching makes sure the
+    # results can be turned into NumPy arrays even if gradients are on in the calling thread.
+    return DetrObjectDetectionOutput(
+        logits=logits.detach().float().cpu(), pred_boxes=pred_boxes.detach().float().cpu()
+    )
+
+
+# Warm up with a couple of forward passes over a realistic batch so the first real request
+# doesn't pay for graph optimization and memory allocation.
+if not IS_RELOADER_PARENT:
+    with torch.inference_mode():
+        for _ in range(2):
+            run_detector(*make_example_batch())
+
+# ----------------- BATCHED INFERENCE -----------------
+# Running the model once per request leaves most of the hardware idle. Instead, concurrent
+# requests hand their image to a single worker thread, which groups them into one batch
+# and runs a single forward pass for all of them.
+# MAX_BATCH_SIZE caps how many images go into one forward pass, and BATCH_WAIT_TIMEOUT_S is
+# how long the worker waits for more requests to arrive before running a partial batch.
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 8))
+BATCH_WAIT_TIMEOUT_S = float(os.environ.get('BATCH_WAIT_TIMEOUT_S', 0.01))
+
+
+def pad_and_stack(pixel_values_list):
+    """
+    Pads preprocessed images to a common height/width and stacks them into one batch.
+    Returns the batched pixel values and a pixel mask marking the real (non-padded) pixels.
+    On a GPU host both are allocated in pinned memory so they can be copied to the GPU faster.
+    """
+    pin_memory = DEVICE == 'cuda'
+    max_height = max(pixel_values.shape[-2] for pixel_values in pixel_values_list)
+    max_width = max(pixel_values.shape[-1] for pixel_values in pixel_values_list)
+    batch_size = len(pixel_values_list)
+    pixel_values_batch = torch.zeros(
+        (batch_size, 3, max_height, max_width), dtype=pixel_values_list[0].dtype, pin_memory=pin_memory
+    )
+    pixel_mask_batch = torch.zeros((batch_size, max_height, max_width), dtype=torch.long, pin_memory=pin_memory)
+    for i, pixel_values in enumerate(pixel_values_list):
+        height, width = pixel_values.shape[-2:]
+        pixel_values_batch[i, :, :height, :width] = pixel_values[0]
+        pixel_mask_batch[i, :height, :width] = 1
+    return pixel_values_batch, pixel_mask_batch
+
+
+class DetectionBatcher:
+    """
+    Collects images from concurrent requests and runs them through the model together.
+    Each call to predict() blocks until the batch containing its image has been processed.
+    """
+
+    def __init__(self, max_batch_size, batch_wait_timeout_s):
+        self.max_batch_size = max_batch_size
+        self.batch_wait_timeout_s = batch_wait_timeout_s
+        self.pending = queue.Queue()
+        # A daemon thread so it doesn't keep the process alive on shutdown
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def predict(self, image, target_size):
+        """
+        Returns the post-processed detection results (scores, labels, boxes) for one image
+        (a PIL image or an RGB array), with boxes scaled to target_size (height, width).
+        """
+        # Preprocessing happens here, in the request's own thread, so it runs in parallel
+        # across requests; only the forward pass is shared.
+        pixel_values = processor(images=image, return_tensors="pt")["pixel_values"]
+        future = Future()
+        self.pending.put((pixel_values, target_size, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            # Wait for a request, then give others a short window to join the same batch
+            batch = collect_batch(self.pending, self.max_batch_size, self.batch_wait_timeout_s)
+            pixel_values_list, target_sizes, futures = zip(*batch)
+            try:
+                # inference_mode skips all autograd bookkeeping. Grad mode is per thread, so
+                # this is needed here even though gradients are disabled at startup.
+                with torch.inference_mode():
+                    pixel_values, pixel_mask = pad_and_stack(pixel_values_list)
+                    # One forward pass for the whole batch
+                    outputs = run_detector(pixel_values, pixel_mask)
+                    # We set a threshold of 0.7 to keep more detections (was 0.9).
+                    results = processor.post_process_object_detection(
+                        outputs, target_sizes=torch.tensor(target_sizes), threshold=0.7
+                    )
+            except Exception as e:
+                # Hand the error back to every waiting request instead of killing the worker
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+
+# The reloader parent never serves requests, so it doesn't need a worker thread
+batcher = None if IS_RELOADER_PARENT else DetectionBatcher(MAX_BATCH_SIZE, BATCH_WAIT_TIMEOUT_S)
+
 # ----------------- SUGGESTION LOGIC -----------------
 # This is a simple rule-based suggestion engine.
 # It's a dictionary where keys are object labels and values are suggestions.
@@ -70,6 +486,123 @@ SUGGESTION_DATABASE = {
     'clock': 'An interesting clock can be a piece of art. Does this one match the room\'s style?',
     'default': 'Try to find a clear subject for your photo. What is the main story you want to tell with this image?'
 }
+# The object labels that have a specific suggestion, precomputed so matching is one set intersection
+SUGGESTION_KEYS = frozenset(SUGGESTION_DATABASE) - {'default'}
+
+
+# ----------------- ANALYSIS -----------------
+
+# The processor scales every image so its longest side is at most this many pixels,
+# so there is no point decoding anything larger than that.
+MAX_DECODE_SIZE = processor.size['longest_edge']
+
+
+def load_image(contents):
+    """
+    Decodes uploaded image bytes into an RGB image for the model.
+    Returns the image and the original (height, width), which the boxes are scaled back to.
+    """
+    if pyvips is None:
+        image = Image.open(io.BytesIO(contents)).convert('RGB')
+        return image, image.size[::-1]
+
+    # Only reads the header, to get the original size
+    original = pyvips.Image.new_from_buffer(contents, '')
+    # Decodes and shrinks in one step; JPEGs are shrunk while decoding, so large photos are
+    # never fully decoded. no_rotate keeps the same orientation as the Pillow path.
+    image = pyvips.Image.thumbnail_buffer(
+        contents, MAX_DECODE_SIZE, height=MAX_DECODE_SIZE, size='down', no_rotate=True
+    )
+    # Make sure we end up with 8-bit RGB, like Pillow's convert('RGB').
+    # Pillow simply drops the alpha channel and keeps the stored colour values, so we do the
+    # same. (flatten() would instead blend transparent pixels onto black, giving the model
+    # different inputs than the Pillow fallback.)
+    if image.hasalpha():
+        image = image.extract_band(0, n=image.bands - 1)
+    if image.interpretation != 'srgb':
+        image = image.colourspace('srgb')
+    # The array below reinterprets the raw pixel bytes as 8-bit values, so anything else would
+    # silently turn into garbage pixels. Fail loudly instead (the request gets a 400 error).
+    if image.format != 'uchar' or image.bands != 3:
+        raise ValueError(f"could not convert image to 8-bit RGB (got {image.bands} bands of {image.format})")
+    array = np.ndarray(
+        buffer=image.write_to_memory(), dtype=np.uint8, shape=[image.height, image.width, image.bands]
+    )
+    return array, (original.height, original.width)
+
+
+def analyze(image, original_size):
+    """
+    Detects the objects in an image and builds the matching suggestions.
+    Boxes are given in the coordinates of the original image, of size original_size (height, width).
+    Returns a (detected_objects, suggestions) pair.
+    """
+    # --- Object Detection ---
+    # The batcher prepares the image, runs it through the model together with any other
+    # images that arrived at the same time, and turns the raw outputs into human-readable results.
+    results = batcher.predict(image, original_size)
+
+    # --- Formatting Results ---
+    # Convert each tensor to NumPy once, rather than pulling out every value with .item()
+    scores = results["scores"].numpy()
+    labels = results["labels"].numpy()
+    # Rounded in float64 so the JSON shows e.g. 12.34 rather than 12.34000015
+    boxes = results["boxes"].double().numpy().round(2)
+    # Build a dictionary for each detected object with its details
+    detected_objects = [
+        {
+            'label': ID2LABEL[int(label)],
+            'confidence': round(float(score), 3), # Confidence score, rounded to 3 decimal places
+            'box': box.tolist() # Bounding box coordinates
+        }
+        for score, label, box in zip(scores, labels, boxes)
+    ]
+
+    # --- Generating Suggestions ---
+    # Create a set of unique labels to avoid duplicate suggestions, and keep only the ones
+    # that have a specific suggestion
+    matched_labels = {d['label'] for d in detected_objects} & SUGGESTION_KEYS
+    # If none of the detected objects has a suggestion (or nothing was detected),
+    # provide the default suggestion
+    suggestions = [SUGGESTION_DATABASE[label] for label in matched_labels] or [SUGGESTION_DATABASE['default']]
+
+    return detected_objects, suggestions
+
+
+# --- Result Cache ---
+# Users often send the same image more than once (retries, re-uploads). Results are cached
+# by a BLAKE3 hash of the image bytes, so a repeated image skips the model entirely.
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 4096))
+
+
+class ResultCache:
+    """
+    A small thread-safe LRU cache mapping an image hash to its (detected_objects, suggestions).
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            # Mark the entry as recently used
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            # Drop the least recently used entry once the cache is full
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+result_cache = ResultCache(RESULT_CACHE_SIZE)
 
 
 # ----------------- API ENDPOINTS -----------------
@@ -87,71 +620,39 @@ def analyze_image():
 
     # Get the image file from the request
     file = request.files['image']
-    
-    # Try to open the image using Pillow to ensure it's a valid image file
-    try:
-        image = Image.open(file.stream).convert('RGB')
-    except Exception as e:
-        # If the file cannot be opened as an image, return an error
-        return jsonify({'error': f'Invalid image file: {e}'}), 400
+    # Read the upload once: the bytes are used both for the cache key and to open the image
+    contents = file.read()
 
-    # --- Object Detection ---
-    # Process the image using the pre-loaded processor. This prepares the image for the model.
-    inputs = processor(images=image, return_tensors="pt")
-    # Pass the processed inputs to the model to get the predictions.
-    outputs = model(**inputs)
-    # The model outputs a lot of data. We need to process it to get human-readable results.
-    # We set a threshold of 0.7 to keep more detections (was 0.9).
-    target_sizes = torch.tensor([image.size[::-1]])
-    results = processor.post_process_object_detection(outputs, target_sizes=target_sizes, threshold=0.7)[0]
+    # Reuse the results if we have already analyzed exactly this image
+    cache_key = blake3(contents).hexdigest()
+    cached_result = result_cache.get(cache_key)
+    if cached_result is not None:
+        detected_objects, suggestions = cached_result
+    else:
+        # Try to decode the image to ensure it's a valid image file
+        try:
+            image, original_size = load_image(contents)
+        except Exception as e:
+            # If the file cannot be opened as an image, return an error
+            return jsonify({'error': f'Invalid image file: {e}'}), 400
 
-    # --- Formatting Results ---
-    detected_objects = []
-    # Loop through the detection results
-    for score, label, box in zip(results["scores"], results["labels"], results["boxes"]):
-        # Get the name of the detected object from the model's configuration
-        label_name = model.config.id2label[label.item()]
-        # Create a dictionary for the detected object with its details
-        detected_objects.append({
-            'label': label_name,
-            'confidence': round(score.item(), 3), # Confidence score, rounded to 3 decimal places
-            'box': [round(i, 2) for i in box.tolist()] # Bounding box coordinates
-        })
+        detected_objects, suggestions = analyze(image, original_size)
+        result_cache.put(cache_key, (detected_objects, suggestions))
 
-    # --- Generating Suggestions ---
-    suggestions = []
-    # Create a set of unique labels to avoid duplicate suggestions
-    unique_labels = set(d['label'] for d in detected_objects)
-    # If no objects are detected, provide a default suggestion
-    if not unique_labels:
-        suggestions.append(SUGGESTION_DATABASE['default'])
-    else:
-        # For each unique object detected, find a corresponding suggestion
-        for label in unique_labels:
-            # If a specific suggestion exists for the label, add it.
-            # Otherwise, you could add a more generic one or do nothing.
-            if label in SUGGESTION_DATABASE:
-                suggestions.append(SUGGESTION_DATABASE[label])
-    
     # --- SAVING TO DATABASE ---
+    # Queue the record for the background writer. We don't want the database to slow down
+    # (or, on errors, stop) the user getting their results, so we don't wait for the commit.
     try:
-        # Create a new record using our AnalysisResult model
-        new_result = AnalysisResult(
-            image_filename=file.filename,
-            detected_objects_json=detected_objects, # The list of dicts we created
-            suggestions_json=suggestions # The list of strings we created
-        )
-        # Add the new record to the database session
-        db.session.add(new_result)
-        # Commit the session to save the changes to the database
-        db.session.commit()
-    except Exception as e:
-        # If there's an error with the database, log it to the server console.
-        # In a real production app, you'd have more robust error logging.
-        print(f"Error saving to database: {e}")
-        # We don't want a DB error to stop the user from getting their results,
-        # so we don't return an error here, we just log it.
-    
+        pending_results.put_nowait({
+            'image_filename': file.filename,
+            'detected_objects_json': detected_objects, # The list of dicts we created
+            'suggestions_json': suggestions, # The list of strings we created
+            'created_at': datetime.utcnow() # Time of the request, not of the later commit
+        })
+    except queue.Full:
+        # The database is falling behind (or down); skip saving rather than use unbounded memory
+        print(f"Database write queue is full, not saving the result for {file.filename}")
+
     # --- Final Response ---
     # Combine the detected objects and suggestions into a single JSON response
     return jsonify({
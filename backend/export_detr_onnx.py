@@ -0,0 +1,52 @@
+# export_detr_onnx.py
+
+# One-off script that exports the DETR model to ONNX.
+# The result is used by app.py when it is started with DETR_RUNTIME=onnx.
+#
+# Requires the conversion tools on top of the app requirements:
+#   pip install -r requirements.txt -r requirements-tools.txt
+#
+# Usage:
+#   python export_detr_onnx.py [output path, default: detr.onnx]
+import sys
+import torch
+from transformers import DetrForObjectDetection
+
+# ONNX operator set to target; 17 is supported by all recent ONNX Runtime releases
+OPSET_VERSION = 17
+
+
+def main():
+    output_path = sys.argv[1] if len(sys.argv) > 1 else 'detr.onnx'
+
+    print("Loading model...")
+    # torchscript=True makes the model return plain tuples, which is what the exporter expects
+    model = DetrForObjectDetection.from_pretrained('facebook/detr-resnet-50', torchscript=True)
+    model.eval()
+
+    # Export with a dummy image, but keep the batch size and image size dynamic so the
+    # app can feed it batches of differently sized images.
+    print(f"Exporting model to {output_path}...")
+    example_pixel_values = torch.zeros(1, 3, 800, 800)
+    example_pixel_mask = torch.ones(1, 800, 800, dtype=torch.long)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (example_pixel_values, example_pixel_mask),
+            output_path,
+            opset_version=OPSET_VERSION,
+            # The model also returns hidden states; only the first two outputs are used by app.py
+            input_names=['pixel_values', 'pixel_mask'],
+            output_names=['logits', 'pred_boxes'],
+            dynamic_axes={
+                'pixel_values': {0: 'batch', 2: 'height', 3: 'width'},
+                'pixel_mask': {0: 'batch', 1: 'height', 2: 'width'},
+                'logits': {0: 'batch'},
+                'pred_boxes': {0: 'batch'},
+            },
+        )
+    print(f"ONNX model saved to {output_path}")
+
+
+if __name__ == '__main__':
+    main()
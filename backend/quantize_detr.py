@@ -0,0 +1,82 @@
+# quantize_detr.py
+
+# One-off script that converts the DETR model to OpenVINO and quantizes it to INT8.
+# The result is used by app.py when it is started with DETR_RUNTIME=openvino.
+#
+# Requires the conversion tools on top of the app requirements:
+#   pip install -r requirements.txt -r requirements-tools.txt
+#
+# Usage:
+#   python quantize_detr.py <folder of calibration images> [output path, default: detr_int8.xml]
+#
+# The calibration images should look like the images the app will see in production.
+# Around 300 images (for example a slice of COCO) is enough.
+import os
+import sys
+import nncf
+import openvino
+import torch
+from PIL import Image
+from transformers import DetrImageProcessor, DetrForObjectDetection
+
+# How many calibration images NNCF looks at when choosing the quantization ranges
+CALIBRATION_SUBSET_SIZE = 300
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python quantize_detr.py <calibration image folder> [output path]")
+        sys.exit(1)
+    calibration_dir = sys.argv[1]
+    output_path = sys.argv[2] if len(sys.argv) > 2 else 'detr_int8.xml'
+
+    print("Loading model...")
+    processor = DetrImageProcessor.from_pretrained('facebook/detr-resnet-50')
+    # torchscript=True makes the model return plain tuples, which is what the converter expects
+    model = DetrForObjectDetection.from_pretrained('facebook/detr-resnet-50', torchscript=True)
+    model.eval()
+
+    # --- Conversion ---
+    # Trace with a dummy image, but keep the batch size and image size dynamic so the
+    # app can feed it batches of differently sized images.
+    print("Converting model to OpenVINO...")
+    example_input = (torch.zeros(1, 3, 800, 800), torch.ones(1, 800, 800, dtype=torch.long))
+    ov_model = openvino.convert_model(
+        model, example_input=example_input, input=[[-1, 3, -1, -1], [-1, -1, -1]]
+    )
+
+    # --- Calibration ---
+    image_paths = sorted(
+        os.path.join(calibration_dir, name)
+        for name in os.listdir(calibration_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    if not image_paths:
+        print(f"No images found in {calibration_dir}")
+        sys.exit(1)
+    print(f"Found {len(image_paths)} calibration images")
+
+    def transform_fn(image_path):
+        # Prepare each image exactly the way app.py does before the forward pass
+        image = Image.open(image_path).convert('RGB')
+        inputs = processor(images=image, return_tensors="pt")
+        return [inputs["pixel_values"].numpy(), inputs["pixel_mask"].numpy()]
+
+    calibration_dataset = nncf.Dataset(image_paths, transform_fn)
+
+    # --- Quantization ---
+    # Only the conv/linear layers are quantized; the post-processing in app.py stays the same.
+    print("Quantizing model to INT8 (this can take a while)...")
+    quantized_model = nncf.quantize(
+        ov_model,
+        calibration_dataset,
+        model_type=nncf.ModelType.TRANSFORMER,
+        subset_size=min(CALIBRATION_SUBSET_SIZE, len(image_paths)),
+    )
+    openvino.save_model(quantized_model, output_path)
+    print(f"INT8 model saved to {output_path}")
+
+
+if __name__ == '__main__':
+    main()